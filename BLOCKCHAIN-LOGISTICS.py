@@ -1,40 +1,555 @@
+import codecs
+import functools
 import hashlib
+import multiprocessing
+import os
+import re
+import struct
+import sys
 import time
 import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field, fields
+from typing import ClassVar
+
+# SHA-256 is plain hashlib: it goes through OpenSSL, which already dispatches
+# to SHA-NI / AVX2 assembly when the CPU supports it.
+
+# Optional C JSON encoder for canonical transaction bytes.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional Numba JIT for the nonce search (SHA-256 compression written out below).
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Optional CUDA backend (CuPy) for high difficulties.
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+SEARCH_CHUNK = 1 << 16          # nonces per search call before checking for a stop signal
+PARALLEL_MIN_DIFFICULTY = 5     # below this, process start-up costs more than the search
+GPU_MIN_DIFFICULTY = 5          # below this, kernel launch and transfer latency dominate
+GPU_MAX_DIFFICULTY = 32         # the kernel compares the top 128 digest bits
+GPU_BATCH = 1 << 20             # nonces per kernel launch (one thread each)
+GPU_THREADS = 256               # threads per CUDA block
+
+# Block header layout: index (u64) | timestamp (f64) | tx_root (32B) | previous_hash (32B),
+# followed by the nonce (u64). Fixed-size, so only the nonce changes between attempts.
+HEADER = struct.Struct(">Qd32s32s")
+NONCE = struct.Struct(">Q")
+
+
+def canonical_json(obj):
+    """Compact, key-sorted UTF-8 JSON.
+
+    Byte-identical with or without orjson only for dicts of str keys and str
+    values (what Tx.to_dict() produces); numbers may be spelled differently.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def _stdout_is_utf8():
+    """True when stdout has a binary buffer and encodes text as UTF-8."""
+    encoding = getattr(sys.stdout, "encoding", None)
+    if not encoding or getattr(sys.stdout, "buffer", None) is None:
+        return False
+    try:
+        return codecs.lookup(encoding).name == "utf-8"
+    except LookupError:
+        return False
+
+
+def pretty_json(obj):
+    """Indented UTF-8 JSON bytes for display, non-ASCII characters kept as-is."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode()
+
+
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+
+def write_out(data):
+    """Write pretty_json() output to stdout, keeping order with earlier print() output.
+
+    A UTF-8 stdout gets the bytes unchanged. Any other stream gets text with
+    non-ASCII characters as JSON \\u escapes, through its own encoding.
+    """
+    if not _stdout_is_utf8():
+        # non-ASCII only occurs inside JSON strings, where \u escapes are equivalent
+        text = _NON_ASCII.sub(lambda m: json.dumps(m.group())[1:-1], data.decode())
+        sys.stdout.write(text)
+        return
+    sys.stdout.flush()
+    sys.stdout.buffer.write(data)
+    sys.stdout.buffer.flush()
+
+
+# ---------- Transactions ----------
+
+@dataclass(slots=True, frozen=True)
+class Tx:
+    """Immutable ledger transaction. `type` is fixed per subclass; to_dict() is hashed and shown."""
+    type: ClassVar[str] = ""
+    batch_id: str
+    actor: str
+    # Merkle leaf hash, computed once at construction (fields cannot change afterwards)
+    _h: bytes = field(default=b"", init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # fields are text: coerce so both JSON encoders hash the same bytes
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if f.init and not isinstance(value, str):
+                object.__setattr__(self, f.name, str(value))
+        object.__setattr__(self, "_h", tx_leaf(self))
+
+
+@dataclass(slots=True, frozen=True)
+class RegisterBatch(Tx):
+    type: ClassVar[str] = "REGISTER_BATCH"
+    product: str
+    qty: str
+    origin: str
+    holder: str
+    note: str = "Initial registration"
+
+    def to_dict(self):
+        return {"type": self.type, "batch_id": self.batch_id, "product": self.product, "qty": self.qty,
+                "origin": self.origin, "holder": self.holder, "actor": self.actor, "note": self.note}
+
+
+@dataclass(slots=True, frozen=True)
+class Transfer(Tx):
+    type: ClassVar[str] = "TRANSFER"
+    from_id: str
+    to_id: str
+    location: str
+    mode: str
+
+    def to_dict(self):
+        return {"type": self.type, "batch_id": self.batch_id, "from": self.from_id, "to": self.to_id,
+                "location": self.location, "mode": self.mode, "actor": self.actor}
+
+
+@dataclass(slots=True, frozen=True)
+class QualityEvent(Tx):
+    type: ClassVar[str] = "QUALITY_EVENT"
+    event: str      # e.g., "TEMP_LOG", "INSPECTION_PASSED", "RECALL_NOTICE"
+    data: str
+
+    def to_dict(self):
+        return {"type": self.type, "batch_id": self.batch_id, "event": self.event, "data": self.data,
+                "actor": self.actor}
+
+
+def tx_leaf(tx):
+    """Merkle leaf for a transaction: SHA-256 of its canonical JSON."""
+    return hashlib.sha256(canonical_json(tx.to_dict())).digest()
+
+
+class MerkleAccumulator:
+    """Incremental Merkle tree: O(log n) per appended leaf, root on demand.
+
+    Keeps the roots of the perfect subtrees built so far ("pending siblings"),
+    largest first. Folding them right-to-left gives the same root as splitting
+    the leaves at the largest power of two (RFC 6962 layout).
+    """
+
+    EMPTY_ROOT = hashlib.sha256(b"").digest()
+
+    def __init__(self):
+        self._peaks = []        # list[(leaf_count, hash)]
+
+    def append(self, leaf):
+        size, node = 1, leaf
+        while self._peaks and self._peaks[-1][0] == size:
+            left_size, left = self._peaks.pop()
+            size, node = left_size + size, hashlib.sha256(left + node).digest()
+        self._peaks.append((size, node))
+
+    def root(self):
+        if not self._peaks:
+            return self.EMPTY_ROOT
+        node = self._peaks[-1][1]
+        for _, left in reversed(self._peaks[:-1]):
+            node = hashlib.sha256(left + node).digest()
+        return node
+
+
+def merkle_root(leaves):
+    acc = MerkleAccumulator()
+    for leaf in leaves:
+        acc.append(leaf)
+    return acc.root()
+
+
+# ---------- SHA-256 compression for the JIT mining loop ----------
+
+_SHA256_IV = (
+    0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+)
+_SHA256_K = (
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+)
+_M32 = 0xFFFFFFFF
+
+
+def _jit(fn):
+    return njit(cache=True)(fn) if njit is not None else fn
+
+
+@_jit
+def _rotr(x, n):
+    return ((x >> n) | (x << (32 - n))) & _M32
+
+
+@_jit
+def _compress(state, w, k, out):
+    """One SHA-256 block: w[:16] holds the message words, out receives state + block."""
+    for i in range(16, 64):
+        s0 = _rotr(w[i - 15], 7) ^ _rotr(w[i - 15], 18) ^ (w[i - 15] >> 3)
+        s1 = _rotr(w[i - 2], 17) ^ _rotr(w[i - 2], 19) ^ (w[i - 2] >> 10)
+        w[i] = (w[i - 16] + s0 + w[i - 7] + s1) & _M32
+    a, b, c, d, e, f, g, h = state[0], state[1], state[2], state[3], state[4], state[5], state[6], state[7]
+    for i in range(64):
+        t1 = (h + (_rotr(e, 6) ^ _rotr(e, 11) ^ _rotr(e, 25)) + ((e & f) ^ (~e & g & _M32)) + k[i] + w[i]) & _M32
+        t2 = ((_rotr(a, 2) ^ _rotr(a, 13) ^ _rotr(a, 22)) + ((a & b) ^ (a & c) ^ (b & c))) & _M32
+        h, g, f, e = g, f, e, (d + t1) & _M32
+        d, c, b, a = c, b, a, (t1 + t2) & _M32
+    out[0] = (state[0] + a) & _M32
+    out[1] = (state[1] + b) & _M32
+    out[2] = (state[2] + c) & _M32
+    out[3] = (state[3] + d) & _M32
+    out[4] = (state[4] + e) & _M32
+    out[5] = (state[5] + f) & _M32
+    out[6] = (state[6] + g) & _M32
+    out[7] = (state[7] + h) & _M32
+
+
+@_jit
+def _find_nonce(midstate, tail, start, stride, count, shift, k):
+    """Search count nonces start, start+stride, ... over an 80-byte header; -1 if none hits.
+
+    midstate is the state after the first 64 header bytes and tail the last 16
+    bytes as four words; the second block is tail || nonce || SHA-256 padding
+    for an 88-byte message. Requires 1 <= difficulty <= 16 (shift in 0..60).
+    """
+    w = np.zeros(64, np.int64)
+    out = np.zeros(8, np.int64)
+    nonce = start
+    for _ in range(count):
+        w[0], w[1], w[2], w[3] = tail[0], tail[1], tail[2], tail[3]
+        w[4] = (nonce >> 32) & _M32
+        w[5] = nonce & _M32
+        w[6] = 0x80000000
+        for i in range(7, 15):
+            w[i] = 0
+        w[15] = 88 * 8
+        _compress(midstate, w, k, out)
+        if shift >= 32:
+            if out[0] >> (shift - 32) == 0:
+                return nonce
+        elif out[0] == 0 and out[1] >> shift == 0:
+            return nonce
+        nonce += stride
+    return -1
+
+
+# ---------- Nonce search ----------
+# Each search covers `count` nonces start, start+stride, ... and returns the
+# first hit or -1, so single-core mining (stride 1) and the per-core workers
+# (stride = worker count) share the same loops.
+
+def _target(difficulty):
+    """(width, threshold): a digest hits when its first `width` bytes, read as a
+    big-endian integer, are below threshold. 8 bytes cover difficulty <= 16;
+    beyond that the compare widens to 128 bits, then to the whole digest. Past
+    64 hex digits nothing can hit (threshold 0), like an unreachable "0" * difficulty."""
+    width = 8 if difficulty <= 16 else 16 if difficulty <= 32 else 32
+    bits = 8 * width - 4 * difficulty
+    return width, 1 << bits if bits >= 0 else 0
+
+
+# The single-buffer loop is generated per difficulty so the compare width and
+# threshold are literals and every name it touches in the loop is a local.
+_MIDSTATE_SEARCH_SRC = """
+def search(prefix, start, stride, count):
+    base = hashlib.sha256(prefix)
+    buf = bytearray({nonce_size})
+    view = memoryview(buf)
+    pack_into, copy, from_bytes = NONCE.pack_into, base.copy, int.from_bytes
+    for nonce in range(start, start + stride * count, stride):
+        pack_into(buf, 0, nonce)
+        h = copy()
+        h.update(view)
+        if from_bytes(h.digest()[:{width}], "big") < {threshold}:
+            return nonce
+    return -1
+"""
+
+
+@functools.cache
+def _midstate_search(difficulty):
+    """Midstate nonce search specialised for one difficulty.
+
+    SHA-256 state is primed with the fixed prefix; each attempt only hashes the
+    nonce, written in place into one preallocated buffer.
+    """
+    width, threshold = _target(difficulty)
+    namespace = {"hashlib": hashlib, "NONCE": NONCE}
+    exec(_MIDSTATE_SEARCH_SRC.format(nonce_size=NONCE.size, width=width, threshold=threshold), namespace)
+    return namespace["search"]
+
+
+def _midstate(prefix):
+    """SHA-256 state after the first 64 bytes of an 80-byte header, plus its last 16 bytes as words."""
+    words = struct.unpack(">20I", prefix)
+    w = np.zeros(64, np.int64)
+    w[:16] = words[:16]
+    midstate = np.zeros(8, np.int64)
+    _compress(np.array(_SHA256_IV, np.int64), w, np.array(_SHA256_K, np.int64), midstate)
+    return midstate, np.array(words[16:], np.int64)
+
+
+def _search_jit(prefix, shift, start, stride, count):
+    # compile-time-typed loop: only the second SHA-256 block depends on the nonce
+    midstate, tail = _midstate(prefix)
+    k = np.array(_SHA256_K, np.int64)
+    return int(_find_nonce(midstate, tail, start, stride, count, shift, k))
+
+
+def _search(prefix, difficulty, start, stride, count):
+    # difficulty = leading zero hex digits = top 4*difficulty bits of the digest
+    if njit is not None and 1 <= difficulty <= 16:
+        return _search_jit(prefix, 64 - 4 * difficulty, start, stride, count)
+    return _midstate_search(difficulty)(prefix, start, stride, count)
+
+
+_stop_event = None
+
+
+def _init_worker(stop_event):
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _mine_stripe(prefix, difficulty, start, stride):
+    """Worker: search one nonce stripe until a hit here or elsewhere; None if beaten."""
+    while not _stop_event.is_set():
+        nonce = _search(prefix, difficulty, start, stride, SEARCH_CHUNK)
+        if nonce >= 0:
+            _stop_event.set()
+            return nonce
+        start += stride * SEARCH_CHUNK
+    return None
+
+
+def _mine_parallel(prefix, difficulty, start, workers):
+    """Search disjoint stripes (start+i, stride=workers) in separate processes."""
+    stop_event = multiprocessing.Event()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(stop_event,)) as pool:
+        futures = [pool.submit(_mine_stripe, prefix, difficulty, start + i, workers) for i in range(workers)]
+        for future in as_completed(futures):
+            nonce = future.result()
+            if nonce is not None:
+                stop_event.set()
+                return nonce
 
 
 class Block:
-    def __init__(self, index, timestamp, transactions, previous_hash):
+    # assigning any of these invalidates the memoized hash check
+    _HASHED_FIELDS = frozenset({
+        "index", "timestamp", "transactions", "note", "tx_root", "previous_hash", "nonce", "hash"
+    })
+
+    def __init__(self, index, timestamp, transactions, previous_hash, tx_root=None, note=None):
         self.index = index
         self.timestamp = timestamp
-        self.transactions = transactions        # list[dict]
+        self.transactions = transactions        # stored as tuple[Tx, ...]
+        self.note = note                        # free-text label (genesis), committed to via tx_root
+        # only the Merkle root of the transactions goes into the hashed header;
+        # roots and hashes are raw 32-byte digests, hex is only for display
+        self.tx_root = tx_root if tx_root is not None else self.compute_tx_root()
         self.previous_hash = previous_hash
         self.nonce = 0
         self.hash = self.calculate_hash()
+        self._hash_verified = True
+
+    def __setattr__(self, name, value):
+        if name == "transactions":
+            value = tuple(value)    # no in-place edits behind the memoized check
+        if name in self._HASHED_FIELDS:
+            object.__setattr__(self, "_hash_verified", False)
+        object.__setattr__(self, name, value)
+
+    def hash_is_valid(self, force=False):
+        """tx_root matches the transactions and the hash matches the header.
+
+        Only recomputed after one of _HASHED_FIELDS was assigned, or with force=True;
+        transactions are immutable Tx records in a tuple, so they cannot change in place.
+        """
+        if force or not self._hash_verified:
+            self._hash_verified = (self.tx_root == self.compute_tx_root()
+                                   and self.hash == self.calculate_hash())
+        return self._hash_verified
+
+    def compute_tx_root(self):
+        # re-encodes every tx on purpose: validation must not trust cached encodings
+        leaves = [tx_leaf(tx) for tx in self.transactions]
+        if self.note is not None:
+            # the note is the first leaf, as the genesis label string used to be the first tx
+            leaves.insert(0, hashlib.sha256(canonical_json(self.note)).digest())
+        return merkle_root(leaves)
+
+    def header_prefix(self):
+        """Fixed-layout header without the nonce: index || timestamp || tx_root || previous_hash."""
+        return HEADER.pack(self.index, self.timestamp, self.tx_root, self.previous_hash)
 
     def calculate_hash(self):
-        block_string = json.dumps({
-            'index': self.index,
-            'timestamp': self.timestamp,
-            'transactions': self.transactions,
-            'previous_hash': self.previous_hash,
-            'nonce': self.nonce
-        }, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+        return hashlib.sha256(self.header_prefix() + NONCE.pack(self.nonce)).digest()
 
     def mine_block(self, difficulty):
-        target = "0" * difficulty
-        while not self.hash.startswith(target):
-            self.nonce += 1
-            self.hash = self.calculate_hash()
-        print(f"✅ Block mined: {self.hash}")
+        prefix = self.header_prefix()
+        workers = os.cpu_count() or 1
+        if GPU_MIN_DIFFICULTY <= difficulty <= GPU_MAX_DIFFICULTY and _cuda_available():
+            self.nonce = _mine_cuda(prefix, difficulty, self.nonce)
+        elif difficulty >= PARALLEL_MIN_DIFFICULTY and workers > 1:
+            self.nonce = _mine_parallel(prefix, difficulty, self.nonce, workers)
+        else:
+            start, nonce = self.nonce, -1
+            while nonce < 0:
+                nonce = _search(prefix, difficulty, start, 1, SEARCH_CHUNK)
+                start += SEARCH_CHUNK
+            self.nonce = nonce
+        self.hash = self.calculate_hash()
+        self._hash_verified = True
+        print(f"✅ Block mined: {self.hash.hex()}")
+
+
+# ---------- CUDA nonce search ----------
+# One thread per nonce; each thread finishes the second SHA-256 block from the
+# shared header midstate (same message layout as _find_nonce) and the lowest
+# winning nonce of a launch is kept with atomicMin. The target is the top 128
+# digest bits, compared as two 64-bit words against a (hi, lo) threshold.
+
+_CUDA_SOURCE = r"""
+__constant__ unsigned int K[64] = {%s};
+
+__device__ __forceinline__ unsigned int rotr(unsigned int x, int n) {
+    return (x >> n) | (x << (32 - n));
+}
+
+extern "C" __global__ void find_nonce(const unsigned int* midstate, const unsigned int* tail,
+                                      unsigned long long base, unsigned long long thr_hi,
+                                      unsigned long long thr_lo, unsigned long long* found) {
+    unsigned long long nonce = base + (unsigned long long)blockIdx.x * blockDim.x + threadIdx.x;
+    unsigned int w[64];
+    w[0] = tail[0]; w[1] = tail[1]; w[2] = tail[2]; w[3] = tail[3];
+    w[4] = (unsigned int)(nonce >> 32);
+    w[5] = (unsigned int)nonce;
+    w[6] = 0x80000000u;
+    for (int i = 7; i < 15; i++) w[i] = 0;
+    w[15] = 88 * 8;
+    for (int i = 16; i < 64; i++) {
+        unsigned int s0 = rotr(w[i - 15], 7) ^ rotr(w[i - 15], 18) ^ (w[i - 15] >> 3);
+        unsigned int s1 = rotr(w[i - 2], 17) ^ rotr(w[i - 2], 19) ^ (w[i - 2] >> 10);
+        w[i] = w[i - 16] + s0 + w[i - 7] + s1;
+    }
+    unsigned int a = midstate[0], b = midstate[1], c = midstate[2], d = midstate[3];
+    unsigned int e = midstate[4], f = midstate[5], g = midstate[6], h = midstate[7];
+    for (int i = 0; i < 64; i++) {
+        unsigned int t1 = h + (rotr(e, 6) ^ rotr(e, 11) ^ rotr(e, 25)) + ((e & f) ^ (~e & g)) + K[i] + w[i];
+        unsigned int t2 = (rotr(a, 2) ^ rotr(a, 13) ^ rotr(a, 22)) + ((a & b) ^ (a & c) ^ (b & c));
+        h = g; g = f; f = e; e = d + t1;
+        d = c; c = b; b = a; a = t1 + t2;
+    }
+    unsigned long long hi = ((unsigned long long)(midstate[0] + a) << 32) | (midstate[1] + b);
+    unsigned long long lo = ((unsigned long long)(midstate[2] + c) << 32) | (midstate[3] + d);
+    if (hi < thr_hi || (hi == thr_hi && lo < thr_lo)) {
+        atomicMin(found, nonce);
+    }
+}
+""" % ", ".join(f"0x{k:08x}u" for k in _SHA256_K)
+
+_NO_NONCE = (1 << 64) - 1
+
+
+@functools.cache
+def _cuda_available():
+    """CUDA device present and the kernel agrees with the CPU search on a probe header."""
+    if cp is None or np is None:
+        return False
+    try:
+        if cp.cuda.runtime.getDeviceCount() == 0:
+            return False
+        probe = HEADER.pack(0, 0.0, bytes(32), bytes(32))
+        return _mine_cuda(probe, 2, 0, launches=1) == _search(probe, 2, 0, 1, SEARCH_CHUNK)
+    except Exception:
+        # any driver, NVRTC or compile failure here just means: mine on the CPU
+        return False
+
+
+@functools.cache
+def _cuda_kernel():
+    return cp.RawKernel(_CUDA_SOURCE, "find_nonce")
+
+
+def _mine_cuda(prefix, difficulty, start, launches=None):
+    """Launch GPU_BATCH-nonce grids from start until one thread hits the target.
+
+    With `launches` set, gives up after that many grids and returns -1.
+    """
+    kernel = _cuda_kernel()
+    midstate, tail = _midstate(prefix)
+    d_midstate = cp.asarray(midstate.astype(np.uint32))
+    d_tail = cp.asarray(tail.astype(np.uint32))
+    found = cp.full(1, _NO_NONCE, dtype=cp.uint64)
+    threshold = 1 << (128 - 4 * difficulty)
+    thr_hi, thr_lo = np.uint64(threshold >> 64), np.uint64(threshold & _NO_NONCE)
+    base = start
+    while launches is None or base < start + launches * GPU_BATCH:
+        kernel((GPU_BATCH // GPU_THREADS,), (GPU_THREADS,),
+               (d_midstate, d_tail, np.uint64(base), thr_hi, thr_lo, found))
+        nonce = int(found.get()[0])
+        if nonce != _NO_NONCE:
+            return nonce
+        base += GPU_BATCH
+    return -1
 
 
 class SupplyChainBlockchain:
     def __init__(self):
         self.chain = [self.create_genesis_block()]
         self.difficulty = 3
-        self.pending_tx = []
+        self.pending_tx = deque()
+        self._pending_by_batch = {}     # batch_id -> pending txs, in mempool order
+        self._pending_root = MerkleAccumulator()
+
+        # Committed state, updated once per mined block (batch_id -> holder / tx list)
+        self._holder = {}
+        self._batch_events = {}
 
         # Authorized participants (ID -> Name/Role)
         self.participants = {
@@ -44,6 +559,14 @@ class SupplyChainBlockchain:
             "RTL001": "CityMart (Retailer)"
         }
 
+        # Role of each participant (ID -> role), checked by equality rather than by name text
+        self.roles = {
+            "MFG001": "MANUFACTURER",
+            "SHP001": "SHIPPER",
+            "DST001": "DISTRIBUTOR",
+            "RTL001": "RETAILER"
+        }
+
         # Validators (who are allowed to mine/validate)
         self.validators = {
             "REG001": "Food Safety Authority",
@@ -51,7 +574,7 @@ class SupplyChainBlockchain:
         }
 
     def create_genesis_block(self):
-        return Block(0, time.time(), ["Genesis Block: Supply Chain Ledger"], "0")
+        return Block(0, time.time(), [], bytes(32), note="Genesis Block: Supply Chain Ledger")
 
     def get_latest_block(self):
         return self.chain[-1]
@@ -59,7 +582,7 @@ class SupplyChainBlockchain:
     # ---------- Core actions ----------
 
     def register_batch(self, manufacturer_id, batch_id, product_name, quantity, origin):
-        if manufacturer_id not in self.participants or "Manufacturer" not in self.participants[manufacturer_id]:
+        if self.roles.get(manufacturer_id) != "MANUFACTURER":
             print("⛔ Only a registered Manufacturer can register a new batch.")
             return
 
@@ -68,20 +591,18 @@ class SupplyChainBlockchain:
             print("⛔ Batch ID already exists. Use a unique batch id.")
             return
 
-        self.pending_tx.append({
-            "type": "REGISTER_BATCH",
-            "batch_id": batch_id,
-            "product": product_name,
-            "qty": quantity,
-            "origin": origin,
-            "holder": manufacturer_id,
-            "actor": manufacturer_id,
-            "note": "Initial registration"
-        })
+        self._queue(RegisterBatch(
+            batch_id=batch_id,
+            actor=manufacturer_id,
+            product=product_name,
+            qty=quantity,
+            origin=origin,
+            holder=manufacturer_id
+        ))
         print(f"✅ Batch {batch_id} registered by {self.participants[manufacturer_id]}")
 
     def transfer_batch(self, from_id, to_id, batch_id, location, transport_mode="TRUCK"):
-        if from_id not in self.participants or to_id not in self.participants:
+        if from_id not in self.roles or to_id not in self.roles:
             print("⛔ Unknown participant(s).")
             return
 
@@ -93,20 +614,19 @@ class SupplyChainBlockchain:
             print("⛔ Transfer failed: current holder mismatch.")
             return
 
-        self.pending_tx.append({
-            "type": "TRANSFER",
-            "batch_id": batch_id,
-            "from": from_id,
-            "to": to_id,
-            "location": location,
-            "mode": transport_mode,
-            "actor": from_id
-        })
+        self._queue(Transfer(
+            batch_id=batch_id,
+            actor=from_id,
+            from_id=from_id,
+            to_id=to_id,
+            location=location,
+            mode=transport_mode
+        ))
         print(f"🔄 Transfer queued: {batch_id} {self.participants[from_id]} ➜ {self.participants[to_id]} at {location} via {transport_mode}")
 
     def add_quality_event(self, actor_id, batch_id, event_type, data):
         # any known participant can log a QC/telemetry event
-        if actor_id not in self.participants and actor_id not in self.validators:
+        if actor_id not in self.roles and actor_id not in self.validators:
             print("⛔ Unknown actor.")
             return
 
@@ -114,13 +634,12 @@ class SupplyChainBlockchain:
             print("⛔ Cannot log quality event: unknown batch.")
             return
 
-        self.pending_tx.append({
-            "type": "QUALITY_EVENT",
-            "batch_id": batch_id,
-            "event": event_type,     # e.g., "TEMP_LOG", "INSPECTION_PASSED", "RECALL_NOTICE"
-            "data": data,
-            "actor": actor_id
-        })
+        self._queue(QualityEvent(
+            batch_id=batch_id,
+            actor=actor_id,
+            event=event_type,
+            data=data
+        ))
         print(f"🧪 Quality event added for {batch_id}: {event_type}")
 
     def mine_pending(self, validator_id):
@@ -136,49 +655,36 @@ class SupplyChainBlockchain:
         # Apply simple sanity checks just before mining (e.g., dedupe conflicting transfers in one block)
         # For demo simplicity we skip advanced checks.
 
-        block = Block(len(self.chain), time.time(), self.pending_tx, self.get_latest_block().hash)
+        block = Block(len(self.chain), time.time(), self.pending_tx, self.get_latest_block().hash,
+                      tx_root=self._pending_root.root())
         block.mine_block(self.difficulty)
         self.chain.append(block)
+        self._index_block(block)
         print(f"📦 Block #{block.index} validated by {self.validators[validator_id]} with {len(block.transactions)} tx(s).")
-        self.pending_tx = []
+        self.pending_tx.clear()
+        self._pending_by_batch.clear()
+        self._pending_root = MerkleAccumulator()
 
     # ---------- Queries / State ----------
 
     def current_holder(self, batch_id):
         """Return current holder ID or None if unknown."""
-        history = self._history(batch_id)
-        if not history:
-            # check pending REGISTER in mempool
-            for tx in self.pending_tx:
-                if isinstance(tx, dict) and tx.get("type") == "REGISTER_BATCH" and tx.get("batch_id") == batch_id:
-                    return tx.get("holder")
-            return None
-
-        # walk through history and pending to compute holder
-        holder = None
-        for tx in history:
-            if tx["type"] == "REGISTER_BATCH":
-                holder = tx["holder"]
-            elif tx["type"] == "TRANSFER":
-                holder = tx["to"]
-
-        # include pending transfers for a near-real-time view
-        for tx in self.pending_tx:
-            if isinstance(tx, dict) and tx.get("batch_id") == batch_id and tx.get("type") == "TRANSFER":
-                holder = tx.get("to")
+        holder = self._holder.get(batch_id)
+
+        # include pending registrations/transfers for a near-real-time view
+        for tx in self._pending_by_batch.get(batch_id, ()):
+            if tx.type == "REGISTER_BATCH":
+                holder = tx.holder
+            elif tx.type == "TRANSFER":
+                holder = tx.to_id
 
         return holder
 
     def trace(self, batch_id):
         """Print full provenance: registration, transfers, QC events."""
-        events = []
-        for block in self.chain:
-            for tx in block.transactions:
-                if isinstance(tx, dict) and tx.get("batch_id") == batch_id:
-                    events.append(tx)
-        for tx in self.pending_tx:
-            if isinstance(tx, dict) and tx.get("batch_id") == batch_id:
-                events.append({**tx, "_pending": True})
+        events = [tx.to_dict() for tx in self._history(batch_id)]
+        for tx in self._pending_by_batch.get(batch_id, ()):
+            events.append({**tx.to_dict(), "_pending": True})
 
         if not events:
             print(f"⚠️ No records found for batch {batch_id}.")
@@ -186,28 +692,43 @@ class SupplyChainBlockchain:
 
         print(f"\n📜 Provenance for Batch {batch_id}:")
         for e in events:
-            print(json.dumps(e, indent=4))
+            write_out(pretty_json(e) + b"\n")
 
         holder = self.current_holder(batch_id)
         if holder:
             print(f"\n🔎 Current holder: {holder} ({self.participants.get(holder, holder)})")
 
-    def print_chain(self):
+    def iter_chain_json(self):
+        """Yield each block as pretty JSON bytes, one block at a time."""
         for block in self.chain:
-            print(json.dumps({
+            view = {
                 "index": block.index,
                 "timestamp": block.timestamp,
-                "transactions": block.transactions,
-                "hash": block.hash,
-                "previous_hash": block.previous_hash
-            }, indent=4))
-            print("-" * 60)
+                "transactions": [tx.to_dict() for tx in block.transactions],
+                "tx_root": block.tx_root.hex(),
+                "hash": block.hash.hex(),
+                "previous_hash": block.previous_hash.hex()
+            }
+            if block.note:
+                view["note"] = block.note
+            yield pretty_json(view)
+
+    def print_chain(self):
+        # streamed block by block, so output starts before the whole chain is encoded
+        for block_json in self.iter_chain_json():
+            write_out(block_json + b"\n" + b"-" * 60 + b"\n")
+
+    def is_chain_valid(self, full=False):
+        """Check hashes and links.
 
-    def is_chain_valid(self):
+        The default trusts the memoized check of blocks none of whose hashed fields
+        were reassigned, and re-derives tx_root and hash for the others. full=True
+        re-hashes every header and transaction list regardless.
+        """
         for i in range(1, len(self.chain)):
             curr = self.chain[i]
             prev = self.chain[i - 1]
-            if curr.hash != curr.calculate_hash():
+            if not curr.hash_is_valid(force=full):
                 return False
             if curr.previous_hash != prev.hash:
                 return False
@@ -215,18 +736,28 @@ class SupplyChainBlockchain:
 
     # ---------- Helpers ----------
 
+    def _queue(self, tx):
+        """Append to the mempool and fold its leaf into the pending Merkle root."""
+        # mining only folds the leaf hashes cached on each tx
+        self.pending_tx.append(tx)
+        self._pending_by_batch.setdefault(tx.batch_id, []).append(tx)
+        self._pending_root.append(tx._h)
+
     def _history(self, batch_id):
-        hist = []
-        for block in self.chain:
-            for tx in block.transactions:
-                if isinstance(tx, dict) and tx.get("batch_id") == batch_id:
-                    hist.append(tx)
-        return hist
+        return self._batch_events.get(batch_id, [])
+
+    def _index_block(self, block):
+        """Fold a newly mined block into the holder / per-batch event indexes."""
+        for tx in block.transactions:
+            self._batch_events.setdefault(tx.batch_id, []).append(tx)
+            if tx.type == "REGISTER_BATCH":
+                self._holder[tx.batch_id] = tx.holder
+            elif tx.type == "TRANSFER":
+                self._holder[tx.batch_id] = tx.to_id
 
     def _batch_exists_in_pending(self, batch_id):
         return any(
-            isinstance(tx, dict) and tx.get("type") == "REGISTER_BATCH" and tx.get("batch_id") == batch_id
-            for tx in self.pending_tx
+            tx.type == "REGISTER_BATCH" for tx in self._pending_by_batch.get(batch_id, ())
         )
 
 